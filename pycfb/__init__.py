@@ -1,4 +1,10 @@
+from .analysis import CFBAnalysis, analyze
+from .archive import from_archive
 from .cfbutility import CFBWriter
+from .index import CFBIndex
+from .reader import CFBReader
+from .template import CFBTemplate
+from .util import CFBEntry
 
 __version_info__ = (0, 0, 3)
 __version__ = '.'.join(str(x) for x in __version_info__)
@@ -0,0 +1,3 @@
+from pycfb.analysis import main
+
+main()
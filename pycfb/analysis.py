@@ -0,0 +1,184 @@
+import argparse
+from dataclasses import dataclass, field
+import math
+import os
+import sys
+from typing import Optional, Union
+
+from pycfb.enums import Sector
+from pycfb.reader import CFBReader
+from pycfb.util import get_runs
+
+@dataclass
+class StreamStats:
+    path: str
+    size: int
+    in_ministream: bool
+    sectors: int            # Minisectors for streams in the ministream
+    padding_bytes: int
+    runs: int
+
+@dataclass
+class CFBAnalysis:
+    path: str
+    file_size: int
+    sector_size: int
+    minisector_size: int
+    mini_cutoff_size: int
+
+    # Sectors by region
+    header_sectors: int = 1
+    fat_sectors: int = 0
+    difat_sectors: int = 0
+    minifat_sectors: int = 0
+    directory_sectors: int = 0
+    ministream_sectors: int = 0
+    stream_sectors: int = 0
+    free_sectors: int = 0
+    unaccounted_sectors: int = 0    # Allocated but not reachable from any chain
+
+    # Ministream usage
+    ministream_size: int = 0
+    ministream_padding_bytes: int = 0
+    free_minisectors: int = 0
+
+    # Streams split around the ministream cutoff
+    ministream_stream_count: int = 0
+    ministream_stream_bytes: int = 0
+    regular_stream_count: int = 0
+    regular_stream_bytes: int = 0
+    fragmented_stream_count: int = 0
+    max_runs: int = 0
+
+    streams: list[StreamStats] = field(default_factory=list)
+
+    @property
+    def total_sectors(self) -> int:
+        return math.ceil(self.file_size / self.sector_size)
+
+    @property
+    def padding_bytes(self) -> int:
+        return sum(x.padding_bytes for x in self.streams) + self.ministream_padding_bytes
+
+    @property
+    def reclaimable_bytes(self) -> int:
+        # Space a repack would drop, not counting per-stream tail padding
+        unused_sectors = self.free_sectors + self.unaccounted_sectors
+        return unused_sectors * self.sector_size + self.free_minisectors * self.minisector_size
+
+    def format(self, streams: bool = False) -> str:
+        lines = [
+            f'{self.path}: {self.file_size} bytes, {self.total_sectors} sectors of {self.sector_size} bytes',
+            f'  header       {self.header_sectors:>10}',
+            f'  fat          {self.fat_sectors:>10}',
+            f'  difat        {self.difat_sectors:>10}',
+            f'  minifat      {self.minifat_sectors:>10}',
+            f'  directory    {self.directory_sectors:>10}',
+            f'  ministream   {self.ministream_sectors:>10}',
+            f'  streams      {self.stream_sectors:>10}',
+            f'  free         {self.free_sectors:>10}',
+            f'  unaccounted  {self.unaccounted_sectors:>10}',
+            f'  streams below {self.mini_cutoff_size} bytes: {self.ministream_stream_count} '
+            f'({self.ministream_stream_bytes} bytes, {self.free_minisectors} free minisectors)',
+            f'  streams of {self.mini_cutoff_size} bytes or more: {self.regular_stream_count} '
+            f'({self.regular_stream_bytes} bytes)',
+            f'  padding: {self.padding_bytes} bytes, reclaimable: {self.reclaimable_bytes} bytes',
+            f'  fragmented streams: {self.fragmented_stream_count} (max {self.max_runs} runs)',
+        ]
+        if streams:
+            for x in self.streams:
+                location = 'mini' if x.in_ministream else 'regular'
+                lines.append(
+                    f'    {x.path}: {x.size} bytes, {location}, {x.sectors} sectors, '
+                    f'{x.padding_bytes} padding, {x.runs} runs'
+                )
+        return '\n'.join(lines)
+
+def analyze(path: Union[str, os.PathLike]) -> CFBAnalysis:
+    """
+    Reports where the bytes in a CFB file go. Every chain is walked once, so the
+    time is linear in the size of the allocation tables.
+    """
+    with CFBReader(path) as reader:
+        result = CFBAnalysis(
+            path=os.fspath(path),
+            file_size=os.path.getsize(path),
+            sector_size=reader.sector_size_bytes,
+            minisector_size=reader.minisector_size_bytes,
+            mini_cutoff_size=reader.header.mini_cutoff_size
+        )
+
+        # FAT entries past the end of the file are padding in the last FAT sector
+        fat = reader.fat[:result.total_sectors - result.header_sectors]
+        result.fat_sectors = fat.count(Sector.FATSECT)
+        result.difat_sectors = fat.count(Sector.DIFSECT)
+        result.free_sectors = fat.count(Sector.FREESECT)
+        result.minifat_sectors = len(reader.get_chain(reader.header.sector_start_minifat, reader.fat))
+        result.directory_sectors = len(reader.dir_sectors)
+
+        ministream_chain = reader.get_stream_chain(reader.root)
+        result.ministream_sectors = len(ministream_chain)
+        result.ministream_size = reader.root.size
+
+        for entry in reader.walk():
+            if not entry.is_stream():
+                continue
+
+            chain = reader.get_stream_chain(entry)
+            in_ministream = reader.is_ministream(entry)
+            unit_size = reader.minisector_size_bytes if in_ministream else reader.sector_size_bytes
+            stats = StreamStats(
+                path=entry.path,
+                size=entry.size,
+                in_ministream=in_ministream,
+                sectors=len(chain),
+                padding_bytes=len(chain) * unit_size - entry.size,
+                runs=len(get_runs(chain))
+            )
+            result.streams.append(stats)
+
+            if in_ministream:
+                result.ministream_stream_count += 1
+                result.ministream_stream_bytes += entry.size
+            else:
+                result.regular_stream_count += 1
+                result.regular_stream_bytes += entry.size
+                result.stream_sectors += stats.sectors
+            if stats.runs > 1:
+                result.fragmented_stream_count += 1
+            result.max_runs = max(result.max_runs, stats.runs)
+
+        if result.ministream_size > 0:
+            ministream_minisectors = result.ministream_size // reader.minisector_size_bytes
+            result.free_minisectors = reader.read_minifat()[:ministream_minisectors].count(Sector.FREESECT)
+            result.ministream_padding_bytes = result.ministream_sectors * reader.sector_size_bytes - result.ministream_size
+
+        result.unaccounted_sectors = result.total_sectors - sum((
+            result.header_sectors,
+            result.fat_sectors,
+            result.difat_sectors,
+            result.minifat_sectors,
+            result.directory_sectors,
+            result.ministream_sectors,
+            result.stream_sectors,
+            result.free_sectors
+        ))
+        return result
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description='Report how space is used in CFB files.')
+    parser.add_argument('paths', nargs='+', help='CFB files to analyze')
+    parser.add_argument('--streams', action='store_true', help='list every stream')
+    args = parser.parse_args(argv)
+
+    # A bad file is reported without stopping the rest
+    failed = False
+    for path in args.paths:
+        try:
+            print(analyze(path).format(streams=args.streams))
+        except (ValueError, OSError) as e:
+            print(f'{path}: {e}', file=sys.stderr)
+            failed = True
+
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,96 @@
+import os
+import tarfile
+from typing import BinaryIO, Optional, Union
+import uuid
+import warnings
+import zipfile
+
+from pycfb.cfbutility import CFBWriter
+from pycfb.constants import HEADER_CLSID_NULL
+from pycfb.util import StreamSource, split_path
+
+def from_archive(
+    src: Union[str, os.PathLike, BinaryIO],
+    out: Union[str, os.PathLike, BinaryIO],
+    root_clsid: uuid.UUID = uuid.UUID(int=HEADER_CLSID_NULL),
+    digest: Optional[str] = None,
+    manifest_path: Optional[str] = None,
+    sparse: bool = False
+) -> CFBWriter:
+    """
+    Converts a tar or zip archive to a CFB file without extracting it to disk.
+    Directory members become storages and file members become streams. Paths and
+    sizes come from the archive index, and member content is read straight into
+    its planned sectors. digest and manifest_path are passed to CFBWriter, and
+    sparse leaves all-zero blocks of out as holes, which needs out to be a path.
+    """
+    if sparse and hasattr(out, 'write'):
+        raise ValueError('Sparse output requires a file path')
+
+    # A tar ending in a zip member (e.g. an .xlsx) also passes is_zipfile, so
+    # tar is checked first
+    if hasattr(src, 'seek'):
+        src.seek(0)
+    if tarfile.is_tarfile(src):
+        if hasattr(src, 'seek'):
+            src.seek(0)
+            archive = tarfile.open(fileobj=src)
+        else:
+            archive = tarfile.open(src)
+        with archive:
+            paths, data = read_tar_index(archive)
+            writer = CFBWriter(paths, data, root_clsid, digest, manifest_path)
+    else:
+        with zipfile.ZipFile(src) as archive:
+            paths, data = read_zip_index(archive)
+            writer = CFBWriter(paths, data, root_clsid, digest, manifest_path)
+
+    if hasattr(out, 'write'):
+        out.write(writer.data)
+    else:
+        writer.save(out, sparse=sparse)
+    return writer
+
+def read_zip_index(archive: zipfile.ZipFile) -> tuple[list[str], list[StreamSource]]:
+    # Later members replace earlier ones with the same name, as on extraction
+    members = {}
+    for info in archive.infolist():
+        path = get_member_path(info.filename)
+        if path is None:
+            continue
+
+        if info.is_dir():
+            members[path] = None
+        else:
+            members[path] = StreamSource(info.file_size, lambda info=info: archive.open(info))
+    return list(members), list(members.values())
+
+def read_tar_index(archive: tarfile.TarFile) -> tuple[list[str], list[StreamSource]]:
+    # Later members replace earlier ones with the same name, as on extraction
+    # (tar -r and -u append new copies rather than replacing)
+    members = {}
+    for member in archive.getmembers():
+        path = get_member_path(member.name)
+        if path is None:
+            continue
+
+        if member.isdir():
+            members[path] = None
+        elif member.isfile():
+            members[path] = StreamSource(member.size, lambda member=member: archive.extractfile(member))
+        elif member.islnk() and isinstance(members.get(get_member_path(member.linkname)), StreamSource):
+            # Hard links share the content of an earlier file member
+            members[path] = members[get_member_path(member.linkname)]
+        else:
+            # Symbolic links and special files have no stream content
+            warnings.warn(f'Skipping archive member that is not a file or directory: {member.name}')
+            members.pop(path, None)
+    return list(members), list(members.values())
+
+def get_member_path(name: str) -> Optional[str]:
+    # Member names are relative to the root storage, even when stored with a
+    # leading '/' (as by tar -P), and may not climb out of it
+    parts = split_path(name)
+    if '..' in parts:
+        raise ValueError(f'Archive member name contains "..": {name}')
+    return '/'.join(parts) if parts else None
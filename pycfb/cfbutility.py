@@ -1,22 +1,61 @@
+import math
+import os
+from typing import Optional, Union
 import uuid
 
+from pycfb.constants import SIZE_MINISTREAM_CUTOFF_BYTES
 from pycfb.context import CFBContext
+from pycfb.digest import new_digest
 from pycfb.difat import CFBDifatMgr
 from pycfb.directory import CFBDirectoryMgr
+from pycfb.enums import DirType
 from pycfb.fat import CFBFatMgr
 from pycfb.header import CFBHeaderMgr
+from pycfb.index import Run, write_index
 from pycfb.minifat import CFBMinifatMgr
 from pycfb.ministream import CFBMinistreamMgr
 from pycfb.stream import CFBStreamMgr
+from pycfb.util import CFBEntry, StreamSource, make_entry, split_path, write_sparse
 
 class CFBWriter:
     def __init__(
         self,
         stream_paths: list[str],
         stream_data: list[bytes],
-        root_clsid: uuid.UUID
+        root_clsid: uuid.UUID,
+        digest: Optional[str] = None,
+        manifest_path: Optional[str] = None
     ):
-        self.ctx = CFBContext(stream_paths, stream_data, root_clsid)
+        """
+        With digest (e.g. 'sha256', 'crc32', 'xxh'), every stream is hashed as it
+        is copied and the results are available from digests. With manifest_path,
+        they are also stored in the file as a stream of "<digest>  <path>" lines.
+        """
+        self.manifest_path = manifest_path
+        if manifest_path is not None:
+            if digest is None:
+                raise ValueError('A manifest requires a digest')
+            # The manifest may not replace an entry, hold one below it, or sit
+            # below a stream. Storages can still contain it
+            manifest_parts = split_path(manifest_path)
+            for path, stream in zip(stream_paths, stream_data):
+                parts = split_path(path)
+                is_parent = stream is None and len(parts) < len(manifest_parts)
+                if not is_parent and parts[:len(manifest_parts)] == manifest_parts[:len(parts)]:
+                    raise ValueError(f'Manifest path conflicts with {path}: {manifest_path}')
+
+            # Digests have a fixed length, so the manifest can be sized up front
+            # and filled in once every stream has been copied
+            digest_size = len(new_digest(digest).hexdigest())
+            manifest_size = sum(
+                len(self.get_manifest_line('0' * digest_size, path))
+                for path, stream in zip(stream_paths, stream_data)
+                if stream is not None
+            )
+            stream_paths = [*stream_paths, manifest_path]
+            stream_data = [*stream_data, StreamSource(manifest_size, None)]
+
+        self.ctx = CFBContext(stream_paths, stream_data, root_clsid, digest)
         self.ctx.header_mgr = CFBHeaderMgr(self.ctx)
         self.ctx.fat_mgr = CFBFatMgr(self.ctx)
         self.ctx.minifat_mgr = CFBMinifatMgr(self.ctx)
@@ -37,6 +76,64 @@ class CFBWriter:
         self.ctx.directory_mgr.allocate()
         self.ctx.header_mgr.update()
 
+        if manifest_path is not None:
+            self.write_manifest()
+
     @property
     def data(self):
         return self.ctx.data
+
+    @property
+    def digests(self) -> dict[str, str]:
+        return self.ctx.digests
+
+    def get_manifest_line(self, digest: str, path: str) -> bytes:
+        return f'{digest}  {path}\n'.encode('utf-8')
+
+    def write_manifest(self):
+        idx = len(self.ctx.stream_paths) - 1
+        del self.ctx.digests[self.manifest_path]
+
+        manifest = b''.join(
+            self.get_manifest_line(self.ctx.digests[path], path)
+            for path, stream in zip(self.ctx.stream_paths[:idx], self.ctx.stream_data[:idx])
+            if stream is not None
+        )
+        offset = self.ctx.get_stream_offset(idx)
+        self.ctx.data[offset : offset + len(manifest)] = manifest
+
+    def save(
+        self,
+        path: Union[str, os.PathLike],
+        index_path: Optional[Union[str, os.PathLike]] = None,
+        sparse: bool = False
+    ):
+        # Sparse output skips all-zero blocks, such as preallocated streams and
+        # sector padding, so they take no disk space
+        with open(path, 'wb') as f:
+            if sparse:
+                write_sparse(f, self.ctx.data)
+            else:
+                f.write(self.ctx.data)
+
+        # The layout is already known, so the sidecar needs no second pass
+        if index_path is not None:
+            write_index(index_path, path, self.get_index_records())
+
+    def get_index_records(self) -> list[tuple[CFBEntry, list[Run]]]:
+        entries = [make_entry(0, self.ctx.directory[0], '')]
+        for i, x in enumerate(self.ctx.file_tree):
+            parent_path = '' if x.parent_index is None else entries[x.parent_index + 1].path
+            entries.append(make_entry(i + 1, self.ctx.directory[i + 1], parent_path))
+
+        records = []
+        for entry in entries:
+            # Every stream, and the ministream, is written to contiguous sectors
+            if entry.size == 0 or entry.type == DirType.STORAGE:
+                runs = []
+            elif entry.type == DirType.STREAM and entry.size < SIZE_MINISTREAM_CUTOFF_BYTES:
+                runs = [(entry.start_sector, math.ceil(entry.size / self.ctx.minisector_size_bytes))]
+            else:
+                runs = [(entry.start_sector, math.ceil(entry.size / self.ctx.sector_size_bytes))]
+            records.append((entry, runs))
+        return records
@@ -17,3 +17,11 @@ SIZE_DIRECTORY_ENTRY_BYTES = 128
 SIZE_FAT_ENTRY_BYTES = 4
 SIZE_MINIFAT_ENTRY_BYTES = 4
 SIZE_MINISTREAM_CUTOFF_BYTES = 4096
+
+# Index Sidecar Constants
+INDEX_SIGNATURE = 0x5844494246435950    # "PYCFBIDX"
+INDEX_VERSION = 2
+
+# Copy Sizes
+SIZE_COPY_CHUNK_BYTES = 0x100000    # Hashed while still in cache
+SIZE_SPARSE_BLOCK_BYTES = 0x1000    # Smallest hole most filesystems can hold
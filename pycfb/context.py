@@ -1,5 +1,6 @@
 import ctypes
 import math
+from typing import Optional
 import uuid
 
 from pycfb.constants import (
@@ -11,25 +12,28 @@ from pycfb.constants import (
     SIZE_FAT_ENTRY_BYTES,
     SIZE_MINISTREAM_CUTOFF_BYTES
 )
-from pycfb.enums import Sector
+from pycfb.digest import Digest, new_digest
 from pycfb.types import (
     DifatSector,
     DirEntry,
     FatSector,
     Header
 )
-from pycfb.util import get_unique_subdirs
+from pycfb.util import FileTreeItem, get_file_tree
 
 class CFBContext:
     def __init__(
         self,
         stream_paths: list[str],
         stream_data: list[bytes],
-        root_clsid: uuid.UUID
+        root_clsid: uuid.UUID,
+        digest: Optional[str] = None
     ):
         self.stream_paths = stream_paths
         self.stream_data = stream_data
         self.root_clsid = root_clsid
+        self.digest = digest
+        self.digests: dict[str, str] = {}
 
         # Calculate sector sizes
         self.sector_size_bytes = 2**(SHIFT_SECTOR_BITS_V3)
@@ -51,6 +55,7 @@ class CFBContext:
 
         self.directory: list[DirEntry] = []
         self.directory_mgr = None
+        self.file_tree: list[FileTreeItem] = []
 
         self.minifat: list[FatSector] = []
         self.minifat_mgr = None
@@ -72,12 +77,20 @@ class CFBContext:
         total_sectors = 1 # Header
         total_sectors += self.calc_difat_size_sectors()
         total_sectors += self.calc_fat_size_sectors()
-        total_sectors += self.calc_dir_size_sectors()
-        total_sectors += self.calc_file_size_sectors()
-        total_sectors += self.calc_minifat_size_sectors()
-        total_sectors += math.ceil(self.calc_ministream_size_bytes()/self.sector_size_bytes)
+        total_sectors += self.calc_data_size_sectors()
         return total_sectors * self.sector_size_bytes
 
+    def new_digest(self) -> Optional[Digest]:
+        if self.digest is None:
+            return None
+        return new_digest(self.digest)
+
+    def get_stream_offset(self, idx: int) -> int:
+        # Offset of a stream's data in the output, including streams stored in the ministream
+        if len(self.stream_data[idx]) >= SIZE_MINISTREAM_CUTOFF_BYTES:
+            return self.stream_start_sectors[idx] * self.sector_size_bytes
+        return self.ministream_start * self.sector_size_bytes + self.ministream_start_minisectors[idx] * self.minisector_size_bytes
+
     def inc_next_freesect(self):
         # Used to track the next available free sector in the file
         self.next_freesect_number += 1
@@ -92,14 +105,9 @@ class CFBContext:
         self.next_minifat += 1
 
     def inc_next_directory(self):
-        # Used to track the next available directory entry in a sector
+        # Used to track the next available directory entry, as an offset into
+        # the (contiguous) directory sectors
         self.next_directory += SIZE_DIRECTORY_ENTRY_BYTES
-        if (self.next_directory % self.sector_size_bytes) == 0:
-            self.next_directory = 0
-            self.fat_mgr.update(self.next_fat, self.next_freesect_offset // self.sector_size_bytes)
-            self.inc_next_fat()
-            self.inc_next_freesect()
-            self.fat_mgr.update(self.next_fat, Sector.ENDOFCHAIN)
 
     def get_sector_offset(self, sector: ctypes.Structure) -> int:
         base_address = ctypes.addressof(ctypes.c_char.from_buffer(self.data))
@@ -111,40 +119,47 @@ class CFBContext:
         sector_number = (sector_offset // self.sector_size_bytes) - 1
         return sector_number
 
-    def calc_difat_size_entries(self) -> int:
-        return self.calc_fat_size_sectors() + 1 # Add one for end-of-chain ???
-
     def calc_difat_size_sectors(self) -> int:
+        return self.calc_difat_size_sectors_for(self.calc_fat_size_sectors())
+
+    def calc_difat_size_sectors_for(self, fat_size_sectors: int) -> int:
         # The DIFAT needs to allocate space for the FAT if it exceeds the 109
         # entries available in the header
-        difat_entries = self.calc_difat_size_entries()
-        difat_size_bytes = (difat_entries - HEADER_DIFAT_COUNT) * SIZE_DIFAT_ENTRY_BYTES
-        difat_size_bytes = max(difat_size_bytes, 0)
-        difat_size_sectors = math.ceil(difat_size_bytes / self.sector_size_bytes)
-        return difat_size_sectors
+        difat_entries = max(fat_size_sectors - HEADER_DIFAT_COUNT, 0)
+        return math.ceil(difat_entries / self.difat_entries_per_sector)
 
     def calc_fat_size_entries(self) -> int:
-        # The FAT needs to allocate space for the directory and each file
-        # including end-of-chains for each
-        fat_entries = self.calc_dir_size_sectors() + 1 # Add one for end-of-chain ???
-        for x in self.calc_file_size_sectors_byfile():
-            fat_entries += x + 1 # Add one for each end-of-chain
-
-        # Include overhead for the FAT sectors themselves
-        fat_entries += (fat_entries // self.fat_entries_per_sector)
-        return fat_entries
+        # The FAT needs one entry per sector after the header, including the
+        # FAT and DIFAT sectors themselves
+        fat_size_sectors = self.calc_fat_size_sectors()
+        difat_size_sectors = self.calc_difat_size_sectors_for(fat_size_sectors)
+        return self.calc_data_size_sectors() + fat_size_sectors + difat_size_sectors
 
     def calc_fat_size_sectors(self) -> int:
-        fat_entries = self.calc_fat_size_entries()
-        fat_size_bytes = fat_entries * SIZE_FAT_ENTRY_BYTES
-        fat_size_sectors = math.ceil(fat_size_bytes / self.sector_size_bytes)
-        return fat_size_sectors
+        # Adding FAT or DIFAT sectors can require more FAT entries, so grow the
+        # FAT until it covers its own overhead
+        data_size_sectors = self.calc_data_size_sectors()
+        fat_size_sectors = 0
+        while True:
+            difat_size_sectors = self.calc_difat_size_sectors_for(fat_size_sectors)
+            fat_entries = data_size_sectors + fat_size_sectors + difat_size_sectors
+            required_sectors = math.ceil(fat_entries / self.fat_entries_per_sector)
+            if required_sectors <= fat_size_sectors:
+                return fat_size_sectors
+            fat_size_sectors = required_sectors
+
+    def calc_data_size_sectors(self) -> int:
+        # Every sector after the header other than the FAT and DIFAT
+        data_size_sectors = self.calc_dir_size_sectors()
+        data_size_sectors += self.calc_file_size_sectors()
+        data_size_sectors += self.calc_minifat_size_sectors()
+        data_size_sectors += math.ceil(self.calc_ministream_size_bytes() / self.sector_size_bytes)
+        return data_size_sectors
 
     def calc_dir_size_entries(self) -> int:
         # The directory tree includes a Root Entry, one entry for each file, and one entry for each folder.
-        file_count = len(self.stream_paths)
-        folder_count = len(get_unique_subdirs(self.stream_paths))
-        return file_count + folder_count + 1 # Adding one for Root Directory
+        # Folders that are also listed in stream_paths only get one entry.
+        return len(get_file_tree(self.stream_paths)) + 1 # Adding one for Root Directory
 
     def calc_dir_size_sectors(self) -> int:
         directory_size_bytes = self.calc_dir_size_entries() * SIZE_DIRECTORY_ENTRY_BYTES
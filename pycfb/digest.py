@@ -0,0 +1,38 @@
+import hashlib
+from typing import Protocol
+import zlib
+
+class Digest(Protocol):
+    def update(self, data: bytes): ...
+    def hexdigest(self) -> str: ...
+
+class Crc32Digest:
+    def __init__(self):
+        self.value = 0
+
+    def update(self, data: bytes):
+        self.value = zlib.crc32(data, self.value)
+
+    def hexdigest(self) -> str:
+        return f'{self.value:08x}'
+
+def new_digest(name: str) -> Digest:
+    # Accepts 'crc32', any hashlib algorithm, or an xxhash algorithm ('xxh' is xxh3_64)
+    if name == 'crc32':
+        return Crc32Digest()
+
+    if name.startswith('xxh'):
+        try:
+            import xxhash
+        except ImportError as e:
+            raise ImportError(f"The '{name}' digest requires the xxhash package") from e
+        algorithm = getattr(xxhash, 'xxh3_64' if name == 'xxh' else name, None)
+        if algorithm is None:
+            raise ValueError(f'Unsupported digest: {name}')
+        return algorithm()
+
+    # Manifests are sized from the digest length, which must not vary
+    digest = hashlib.new(name)
+    if digest.digest_size == 0:
+        raise ValueError(f'Unsupported variable-length digest: {name}')
+    return digest
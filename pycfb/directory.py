@@ -1,11 +1,12 @@
 from collections import defaultdict
 import ctypes
+import math
 
 from pycfb.constants import SIZE_MINISTREAM_CUTOFF_BYTES
 from pycfb.context import CFBContext
 from pycfb.enums import DirColor, DirType, Sector
 from pycfb.types import DirEntry
-from pycfb.util import get_file_tree
+from pycfb.util import get_dir_name_key, get_file_tree
 
 class CFBDirectoryMgr:
     def __init__(
@@ -19,14 +20,14 @@ class CFBDirectoryMgr:
 
         # Root Entry
         self.ctx.directory.append(self.allocate_root())
-        self.ctx.fat_mgr.update(self.ctx.next_fat, Sector.ENDOFCHAIN)
         self.ctx.inc_next_directory()
 
         dirs = get_file_tree(self.ctx.stream_paths)
+        self.ctx.file_tree = dirs
 
         # Storage and Stream entries
         for i, x in enumerate(dirs):
-            if self.ctx.stream_data[x.original_index] is None:
+            if x.original_index is None or self.ctx.stream_data[x.original_index] is None:
                 x.is_file = False
 
             raw_name = f'{x.name[:31]}\x00'.encode('utf-16-le')
@@ -60,6 +61,16 @@ class CFBDirectoryMgr:
             parent_idx = -1 if x.parent_index is None else x.parent_index
             children_map[parent_idx].append(i + 1)
 
+        # Siblings are told apart by their stored names, which are truncated and
+        # compared without case
+        for children in children_map.values():
+            keys = {}
+            for idx in children:
+                key = get_dir_name_key(dirs[idx-1].name[:31])
+                if key in keys:
+                    raise ValueError(f'Entry names collide in CFB: {keys[key]}, {dirs[idx-1].path}')
+                keys[key] = dirs[idx-1].path
+
         def build_balanced_tree(indices, color=DirColor.BLACK):
             """
             Recursively builds a balanced binary tree.
@@ -68,8 +79,8 @@ class CFBDirectoryMgr:
             if not indices:
                 return Sector.NOSTREAM
 
-            # Sort by name length, then uppercase
-            indices.sort(key=lambda idx: (len(dirs[idx-1].name), dirs[idx-1].name.upper()))
+            # Sort by name length, then uppercase, as the names are stored
+            indices.sort(key=lambda idx: get_dir_name_key(dirs[idx-1].name[:31]))
 
             mid = len(indices) // 2
             current_node_idx = indices[mid]            
@@ -92,6 +103,13 @@ class CFBDirectoryMgr:
             else:
                 self.ctx.directory[parent_idx + 1].child_id = child_tree_root
 
+        # Chain the directory sectors, which were filled contiguously
+        dir_size_sectors = math.ceil(self.ctx.next_directory / self.ctx.sector_size_bytes)
+        for x in range(dir_size_sectors):
+            if x > 0:
+                self.ctx.fat_mgr.update(self.ctx.next_fat - 1, self.ctx.next_fat)
+
+            self.ctx.fat_mgr.update(self.ctx.next_fat, Sector.ENDOFCHAIN)
             self.ctx.inc_next_fat()
             self.ctx.inc_next_freesect()
 
@@ -0,0 +1,215 @@
+from array import array
+import ctypes
+import hashlib
+import mmap
+import os
+from typing import Iterator, Optional, Union
+import uuid
+
+from pycfb.constants import INDEX_SIGNATURE, INDEX_VERSION
+from pycfb.enums import DirType
+from pycfb.types import Header, IndexHeader, IndexRecord
+from pycfb.util import CFBEntry, get_dir_name_key, split_path
+
+Run = tuple[int, int]
+
+class CFBIndex:
+    """
+    Read-only view of an index sidecar, which maps each path in a CFB file to its
+    directory entry and the (start, count) runs of sectors holding its data.
+    Runs are in minisectors for streams stored in the ministream.
+
+    The sidecar is memory-mapped, so processes opening the same index share its
+    pages, and records are only decoded when they are looked up.
+    """
+    def __init__(
+        self,
+        path: Union[str, os.PathLike]
+    ):
+        self.mmap = None
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < ctypes.sizeof(IndexHeader):
+                raise ValueError('Not a supported CFB index file')
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mmap)
+
+        self.header = IndexHeader.from_buffer_copy(self.view[:ctypes.sizeof(IndexHeader)])
+        if self.header.signature != INDEX_SIGNATURE or self.header.version != INDEX_VERSION:
+            self.close()
+            raise ValueError('Not a supported CFB index file')
+
+        # Every record must start inside the file; their ends are checked as
+        # they are read
+        table_offset = ctypes.sizeof(IndexHeader)
+        table_size_bytes = self.header.entry_count * ctypes.sizeof(ctypes.c_uint32)
+        if table_offset + table_size_bytes > len(self.view):
+            self.close()
+            raise ValueError('Corrupt CFB index file')
+        self.offsets = self.view[table_offset : table_offset + table_size_bytes].cast('I')
+        if self.header.entry_count > 0 and max(self.offsets) + ctypes.sizeof(IndexRecord) > len(self.view):
+            self.close()
+            raise ValueError('Corrupt CFB index file')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.mmap is None:
+            return
+        if hasattr(self, 'offsets'):
+            self.offsets.release()
+        self.view.release()
+        self.mmap.close()
+        self.mmap = None
+
+    def matches(self, cfb_path: Union[str, os.PathLike]) -> bool:
+        # An index is only valid for the exact file it was built from
+        stat = os.stat(cfb_path)
+        if stat.st_size != self.header.file_size or stat.st_mtime_ns != self.header.file_mtime_ns:
+            return False
+        return bytes(self.header.header_hash) == get_header_hash(cfb_path)
+
+    def read_record_header(self, idx: int) -> tuple[IndexRecord, int]:
+        # The fixed part of a record and its offset, checked against the file size
+        offset = self.offsets[idx]
+        record = IndexRecord.from_buffer_copy(self.view[offset : offset + ctypes.sizeof(IndexRecord)])
+        record_size_bytes = ctypes.sizeof(IndexRecord) + record.path_len_bytes
+        record_size_bytes += (record.run_count * 2 + record.child_count) * ctypes.sizeof(ctypes.c_uint32)
+        if offset + record_size_bytes > len(self.view):
+            raise ValueError('Corrupt CFB index file')
+        return record, offset + ctypes.sizeof(IndexRecord)
+
+    def get_path(self, idx: int) -> bytes:
+        record, offset = self.read_record_header(idx)
+        return bytes(self.view[offset : offset + record.path_len_bytes])
+
+    def find(self, path: bytes) -> int:
+        # Index of the first record whose path is not less than the given path
+        lo, hi = 0, self.header.entry_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.get_path(mid) < path:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def read_record(self, idx: int) -> tuple[CFBEntry, list[Run]]:
+        record, offset = self.read_record_header(idx)
+        path = bytes(self.view[offset : offset + record.path_len_bytes]).decode('utf-8')
+        offset += record.path_len_bytes
+        runs = array('I')
+        runs.frombytes(self.view[offset : offset + record.run_count * runs.itemsize * 2])
+
+        object_type = DirType(record.object_type)
+        entry = CFBEntry(
+            id=record.id,
+            path=path,
+            name='Root Entry' if object_type == DirType.ROOTSTORAGE else path.rsplit('/', 1)[-1],
+            type=object_type,
+            size=record.size_bytes,
+            start_sector=record.sector_start,
+            clsid=uuid.UUID(bytes=bytes(record.clsid)),
+            time_created=record.time_created,
+            time_modified=record.time_modified,
+            child_id=record.child_id
+        )
+        return entry, list(zip(runs[0::2], runs[1::2]))
+
+    def get(self, path: str) -> Optional[tuple[CFBEntry, list[Run]]]:
+        key = '/'.join(split_path(path)).encode('utf-8')
+        idx = self.find(key)
+        if idx < self.header.entry_count and self.get_path(idx) == key:
+            return self.read_record(idx)
+        return None
+
+    def get_children(self, idx: int) -> array:
+        # Record numbers of the direct children, stored after the runs
+        record, offset = self.read_record_header(idx)
+        children = array('I')
+        offset += record.path_len_bytes + record.run_count * children.itemsize * 2
+        children.frombytes(self.view[offset : offset + record.child_count * children.itemsize])
+        if any(x >= self.header.entry_count for x in children):
+            raise ValueError('Corrupt CFB index file')
+        return children
+
+    def iter_children(self, storage_path: str) -> Iterator[tuple[CFBEntry, list[Run]]]:
+        # Only the storage's own children are decoded, in CFB name order
+        key = '/'.join(split_path(storage_path)).encode('utf-8')
+        idx = self.find(key)
+        if idx >= self.header.entry_count or self.get_path(idx) != key:
+            return
+        for child in self.get_children(idx):
+            yield self.read_record(child)
+
+def get_header_hash(cfb_path: Union[str, os.PathLike]) -> bytes:
+    with open(cfb_path, 'rb') as f:
+        return hashlib.sha256(f.read(ctypes.sizeof(Header))).digest()
+
+def write_index(
+    index_path: Union[str, os.PathLike],
+    cfb_path: Union[str, os.PathLike],
+    records: list[tuple[CFBEntry, list[Run]]]
+):
+    # Records are sorted by UTF-8 path so that lookups can binary search
+    records = sorted(records, key=lambda x: x[0].path.encode('utf-8'))
+    stat = os.stat(cfb_path)
+
+    # Each storage lists its children's record numbers in CFB name order
+    numbers = {entry.path: idx for idx, (entry, _) in enumerate(records)}
+    children: dict[str, list[CFBEntry]] = {}
+    for entry, _ in records:
+        if entry.type != DirType.ROOTSTORAGE:
+            children.setdefault(entry.path.rpartition('/')[0], []).append(entry)
+    for x in children.values():
+        x.sort(key=lambda entry: get_dir_name_key(entry.name))
+
+    header = IndexHeader()
+    header.signature = INDEX_SIGNATURE
+    header.version = INDEX_VERSION
+    header.entry_count = len(records)
+    header.file_size = stat.st_size
+    header.file_mtime_ns = stat.st_mtime_ns
+    header.header_hash[:] = get_header_hash(cfb_path)
+
+    offsets = array('I')
+    body = bytearray()
+    base_offset = ctypes.sizeof(IndexHeader) + len(records) * offsets.itemsize
+    for entry, runs in records:
+        path = entry.path.encode('utf-8')
+        record = IndexRecord()
+        record.id = entry.id
+        record.child_id = entry.child_id
+        record.object_type = entry.type
+        record.path_len_bytes = len(path)
+        record.sector_start = entry.start_sector
+        record.size_bytes = entry.size
+        record.clsid = (ctypes.c_byte * 16).from_buffer_copy(entry.clsid.bytes)
+        record.time_created = entry.time_created
+        record.time_modified = entry.time_modified
+        record.run_count = len(runs)
+        child_numbers = [numbers[x.path] for x in children.get(entry.path, [])] if entry.is_storage() else []
+        record.child_count = len(child_numbers)
+
+        offsets.append(base_offset + len(body))
+        body += bytes(record)
+        body += path
+        body += array('I', [x for run in runs for x in run]).tobytes()
+        body += array('I', child_numbers).tobytes()
+
+    # Readers in other processes see either the old sidecar or the complete
+    # new one, never a partly written file
+    tmp_path = f'{os.fspath(index_path)}.{uuid.uuid4().hex}.tmp'
+    try:
+        with open(tmp_path, 'xb') as f:
+            f.write(bytes(header))
+            f.write(offsets.tobytes())
+            f.write(body)
+        os.replace(tmp_path, index_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
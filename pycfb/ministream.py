@@ -1,8 +1,11 @@
 import math
+from typing import Optional, Union
 
 from pycfb.constants import SIZE_MINISTREAM_CUTOFF_BYTES
 from pycfb.context import CFBContext
+from pycfb.digest import Digest
 from pycfb.enums import Sector
+from pycfb.util import StreamSource, copy_stream
 
 class CFBMinistreamMgr:
     def __init__(
@@ -19,22 +22,25 @@ class CFBMinistreamMgr:
 
             if len(stream) < SIZE_MINISTREAM_CUTOFF_BYTES:
                 self.ctx.ministream_start_minisectors[idx] = self.ctx.next_minifat
-                self.write_stream(stream)
+                digest = self.ctx.new_digest()
+                self.write_stream(stream, digest)
+                if digest is not None:
+                    self.ctx.digests[self.ctx.stream_paths[idx]] = digest.hexdigest()
 
-    def write_stream(self, stream_data: bytes):
-        view = memoryview(self.ctx.ministream_data)
+    def write_stream(
+        self,
+        stream_data: Union[bytes, StreamSource],
+        digest: Optional[Digest] = None
+    ):
+        offset = self.ctx.next_minifat * self.ctx.minisector_size_bytes
         stream_size_sectors = math.ceil(len(stream_data) / self.ctx.minisector_size_bytes)
 
         for x in range(stream_size_sectors):
-            start = x * self.ctx.minisector_size_bytes
-            chunk = stream_data[start : start + self.ctx.minisector_size_bytes]
-            if len(chunk) < self.ctx.minisector_size_bytes:
-                chunk = chunk.ljust(self.ctx.minisector_size_bytes, b'\x00')
-
-            offset = self.ctx.next_minifat * self.ctx.minisector_size_bytes
             self.ctx.minifat_mgr.update(self.ctx.next_minifat, Sector.ENDOFCHAIN)
             if x > 0:
                 self.ctx.minifat_mgr.update(self.ctx.next_minifat - 1, self.ctx.next_minifat)
-
-            view[offset : offset + self.ctx.minisector_size_bytes] = chunk
             self.ctx.inc_next_minifat()
+
+        # Minisectors are allocated contiguously and the tail is already zero-filled
+        view = memoryview(self.ctx.ministream_data)
+        copy_stream(view[offset : offset + len(stream_data)], stream_data, digest)
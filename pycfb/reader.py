@@ -0,0 +1,376 @@
+from array import array
+import ctypes
+import mmap
+import os
+import sys
+from types import MappingProxyType
+from typing import Callable, Iterator, Mapping, Optional, Union
+
+from pycfb.constants import HEADER_DIFAT_COUNT, HEADER_SIGNATURE, SIZE_DIRECTORY_ENTRY_BYTES
+from pycfb.enums import DirType, Sector
+from pycfb.index import CFBIndex, Run, write_index
+from pycfb.types import DirEntry, Header
+from pycfb.util import (
+    CFBEntry,
+    get_dir_name_key,
+    get_direntry_name,
+    get_runs,
+    make_entry,
+    split_path
+)
+
+class CFBReader:
+    def __init__(
+        self,
+        source: Union[str, os.PathLike, bytes, bytearray, memoryview],
+        threadsafe: bool = False,
+        index_path: Optional[Union[str, os.PathLike]] = None
+    ):
+        """
+        With threadsafe=True the directory and allocation tables are parsed once
+        up front and never modified, and file data is read with os.pread (or a
+        shared mmap where pread is unavailable). Any number of threads can then
+        use the reader without locking.
+
+        With index_path, a sidecar written by CFBWriter.save or write_index is
+        used in place of the FAT and directory, as long as it still matches the
+        file. A stale sidecar is ignored.
+        """
+        self.path = None
+        self.index: Optional[CFBIndex] = None
+        self.file = None
+        self.fd = None
+        self.mmap = None
+        self.view = None
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            self.view = memoryview(source)
+        else:
+            self.path = os.fspath(source)
+            if not threadsafe:
+                self.file = open(self.path, 'rb')
+            elif hasattr(os, 'pread'):
+                self.fd = os.open(self.path, os.O_RDONLY)
+            else:
+                with open(self.path, 'rb') as f:
+                    self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.view = memoryview(self.mmap)
+
+        self.fat: Optional[array] = None
+        self.dir_sectors: Optional[list[int]] = None
+        self.minifat: Optional[array] = None
+        self.ministream_sectors: Optional[list[int]] = None
+        self.entries: Optional[Mapping[str, CFBEntry]] = None
+        self.children: Optional[Mapping[str, tuple[CFBEntry, ...]]] = None
+
+        # The file is closed again if it turns out not to be readable
+        try:
+            self.read_header()
+            if index_path is not None:
+                if self.path is None:
+                    raise ValueError('An index sidecar can only be used with a file path')
+                self.index = self.open_index(index_path)
+
+            if self.index is not None:
+                # Everything except stream data comes from the sidecar
+                self.root, root_runs = self.index.get('')
+                self.ministream_sectors = expand_runs(root_runs)
+            else:
+                self.read_tables(threadsafe)
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.index is not None:
+            self.index.close()
+        if self.file is not None:
+            self.file.close()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        if self.mmap is not None:
+            self.view.release()
+            self.mmap.close()
+            self.mmap = None
+
+    def read_header(self):
+        header = self.read_at(0, ctypes.sizeof(Header))
+        if len(header) < ctypes.sizeof(Header):
+            raise ValueError('Not a CFB file (too short for a header)')
+        self.header = Header.from_buffer_copy(header)
+        if self.header.signature != HEADER_SIGNATURE:
+            raise ValueError('Not a CFB file (bad header signature)')
+
+        self.sector_size_bytes = 2**self.header.sector_shift
+        self.minisector_size_bytes = 2**self.header.mini_sector_shift
+        self.dir_entries_per_sector = self.sector_size_bytes // SIZE_DIRECTORY_ENTRY_BYTES
+
+    def open_index(self, index_path: Union[str, os.PathLike]) -> Optional[CFBIndex]:
+        # A missing, unreadable or stale sidecar is ignored
+        try:
+            index = CFBIndex(index_path)
+        except (OSError, ValueError):
+            return None
+        try:
+            if index.matches(self.path) and index.get('') is not None:
+                return index
+        except ValueError:
+            pass
+        index.close()
+        return None
+
+    def read_tables(self, threadsafe: bool):
+        # Allocation tables are needed for any access, directory entries are
+        # only decoded when a walk or lookup reaches them
+        self.fat = self.read_fat()
+        self.dir_sectors = self.get_chain(self.header.sector_start_directory, self.fat)
+        self.root = make_entry(0, self.read_direntry(0), '')
+
+        # In threadsafe mode nothing is loaded lazily
+        if threadsafe:
+            self.read_minifat()
+
+            # Each storage's children are kept in CFB order for scandir and walk
+            entries = {self.root.path: self.root}
+            children = {}
+            seen = {self.root.id}
+            pending = [self.root]
+            while pending:
+                storage = pending.pop()
+                children[storage.path] = tuple(self.iter_children(storage))
+                for x in children[storage.path]:
+                    if x.id in seen:
+                        raise ValueError('Corrupt directory tree')
+                    seen.add(x.id)
+                    entries[x.path] = x
+                    if x.is_storage():
+                        pending.append(x)
+
+            self.entries = MappingProxyType(entries)
+            self.children = MappingProxyType(children)
+
+    def read_at(self, offset: int, size: int) -> bytes:
+        if self.view is not None:
+            return bytes(self.view[offset : offset + size])
+
+        if self.fd is not None:
+            data = os.pread(self.fd, size, offset)
+            while len(data) < size:
+                chunk = os.pread(self.fd, size - len(data), offset + len(data))
+                if not chunk:
+                    break
+                data += chunk
+            return data
+
+        self.file.seek(offset)
+        return self.file.read(size)
+
+    def read_table(self, sectors: list[int]) -> array:
+        table = array('I')
+        for start, count in get_runs(sectors):
+            table.frombytes(self.read_at(self.get_sector_offset(start), count * self.sector_size_bytes))
+        if sys.byteorder == 'big':
+            table.byteswap()
+        return table
+
+    def read_fat(self) -> array:
+        fat_sectors = list(self.header.sector_data_difat[:min(self.header.sector_count_fat, HEADER_DIFAT_COUNT)])
+
+        # FAT sectors past the first 109 are listed in the DIFAT chain
+        difat_sector = self.header.sector_start_difat
+        for _ in range(self.header.sector_count_difat):
+            entries = self.read_table([difat_sector])
+            fat_sectors.extend(entries[:-1])
+            difat_sector = entries[-1]
+        del fat_sectors[self.header.sector_count_fat:]
+
+        return self.read_table(fat_sectors)
+
+    def read_minifat(self) -> array:
+        if self.minifat is None:
+            self.minifat = self.read_table(self.get_chain(self.header.sector_start_minifat, self.fat))
+            self.ministream_sectors = self.get_stream_chain(self.root)
+        return self.minifat
+
+    def get_chain(self, start: int, table: array) -> list[int]:
+        chain = []
+        sector = start
+        while sector != Sector.ENDOFCHAIN:
+            if sector >= len(table) or len(chain) >= len(table):
+                raise ValueError(f'Corrupt sector chain starting at {start}')
+            chain.append(sector)
+            sector = table[sector]
+        return chain
+
+    def get_sector_offset(self, sector: int) -> int:
+        # Sector numbers start after the header, which fills the first sector
+        return (sector + 1) * self.sector_size_bytes
+
+    def get_minisector_offset(self, minisector: int) -> int:
+        offset = minisector * self.minisector_size_bytes
+        sector = self.ministream_sectors[offset // self.sector_size_bytes]
+        return self.get_sector_offset(sector) + (offset % self.sector_size_bytes)
+
+    def read_direntry(self, sid: int) -> DirEntry:
+        if sid >= len(self.dir_sectors) * self.dir_entries_per_sector:
+            raise ValueError('Corrupt directory tree')
+        sector = self.dir_sectors[sid // self.dir_entries_per_sector]
+        offset = self.get_sector_offset(sector)
+        offset += (sid % self.dir_entries_per_sector) * SIZE_DIRECTORY_ENTRY_BYTES
+        return DirEntry.from_buffer_copy(self.read_at(offset, SIZE_DIRECTORY_ENTRY_BYTES))
+
+    def stat(self, path: str) -> CFBEntry:
+        """
+        Finds an entry by path, descending each storage's red-black tree in
+        CFB name order rather than scanning its children.
+        """
+        if self.entries is not None:
+            return self.stat_from_paths(path, self.entries.get)
+
+        if self.index is not None:
+            return self.stat_from_paths(path, self.get_index_entry)
+
+        entry = self.root
+        for name in split_path(path):
+            if not entry.is_storage():
+                raise NotADirectoryError(entry.path)
+
+            key = get_dir_name_key(name)
+            sid = entry.child_id
+            visited = set()
+            while sid != Sector.NOSTREAM:
+                if sid in visited:
+                    raise ValueError('Corrupt directory tree')
+                visited.add(sid)
+                direntry = self.read_direntry(sid)
+                sibling_key = get_dir_name_key(get_direntry_name(direntry))
+                if key == sibling_key:
+                    entry = make_entry(sid, direntry, entry.path)
+                    break
+                sid = direntry.left_sibling_id if key < sibling_key else direntry.right_sibling_id
+            else:
+                raise FileNotFoundError(path)
+        return entry
+
+    def stat_from_paths(self, path: str, lookup: Callable[[str], Optional[CFBEntry]]) -> CFBEntry:
+        # Looks up each ancestor in turn so that errors match the tree descent
+        parts = split_path(path)
+        entry = self.root
+        for i in range(len(parts)):
+            if not entry.is_storage():
+                raise NotADirectoryError(entry.path)
+            entry = lookup('/'.join(parts[:i + 1]))
+            if entry is None:
+                raise FileNotFoundError(path)
+        return entry
+
+    def get_index_entry(self, path: str) -> Optional[CFBEntry]:
+        record = self.index.get(path)
+        return None if record is None else record[0]
+
+    def scandir(self, storage_path: str = '') -> Iterator[CFBEntry]:
+        # Yields the direct children of a storage in CFB name order
+        storage = self.stat(storage_path)
+        if not storage.is_storage():
+            raise NotADirectoryError(storage_path)
+        return self.iter_children(storage)
+
+    def walk(self, storage_path: str = '') -> Iterator[CFBEntry]:
+        # Yields every entry below a storage, depth first
+        storage = self.stat(storage_path)
+        if not storage.is_storage():
+            raise NotADirectoryError(storage_path)
+
+        # A child pointing back at an ancestor would otherwise never finish
+        seen = {storage.id}
+        pending = [self.iter_children(storage)]
+        while pending:
+            entry = next(pending[-1], None)
+            if entry is None:
+                pending.pop()
+                continue
+            if entry.id in seen:
+                raise ValueError('Corrupt directory tree')
+            seen.add(entry.id)
+            yield entry
+            if entry.is_storage():
+                pending.append(self.iter_children(entry))
+
+    def iter_children(self, storage: CFBEntry) -> Iterator[CFBEntry]:
+        if self.children is not None:
+            yield from self.children[storage.path]
+            return
+
+        if self.index is not None:
+            for entry, _ in self.index.iter_children(storage.path):
+                yield entry
+            return
+
+        # In-order traversal of the sibling tree, one entry read per node.
+        # Every node is visited once, so a repeat means the tree has a cycle
+        stack: list[tuple[int, DirEntry]] = []
+        visited = set()
+        sid = storage.child_id
+        while stack or sid != Sector.NOSTREAM:
+            while sid != Sector.NOSTREAM:
+                if sid in visited:
+                    raise ValueError('Corrupt directory tree')
+                visited.add(sid)
+                direntry = self.read_direntry(sid)
+                stack.append((sid, direntry))
+                sid = direntry.left_sibling_id
+            sid, direntry = stack.pop()
+            yield make_entry(sid, direntry, storage.path)
+            sid = direntry.right_sibling_id
+
+    def get_stream_chain(self, entry: CFBEntry) -> list[int]:
+        # Sector numbers holding an entry's data, or minisector numbers for
+        # streams stored in the ministream
+        if entry.size == 0 or entry.type == DirType.STORAGE:
+            return []
+        if self.index is not None:
+            return expand_runs(self.index.get(entry.path)[1])
+        if self.is_ministream(entry):
+            return self.get_chain(entry.start_sector, self.read_minifat())
+        return self.get_chain(entry.start_sector, self.fat)
+
+    def is_ministream(self, entry: CFBEntry) -> bool:
+        return entry.is_stream() and entry.size < self.header.mini_cutoff_size
+
+    def read(self, path: str) -> bytes:
+        entry = self.stat(path)
+        if not entry.is_stream():
+            raise IsADirectoryError(path)
+
+        chain = self.get_stream_chain(entry)
+        if self.is_ministream(entry):
+            offsets = [self.get_minisector_offset(x) for x in chain]
+            unit_size = self.minisector_size_bytes
+        else:
+            offsets = [self.get_sector_offset(x) for x in chain]
+            unit_size = self.sector_size_bytes
+
+        # Contiguous sectors are read together
+        data = bytearray()
+        for start, count in get_runs(offsets, unit_size):
+            data += self.read_at(start, count * unit_size)
+        del data[entry.size:]
+        return bytes(data)
+
+    def get_index_records(self) -> list[tuple[CFBEntry, list[Run]]]:
+        return [(x, get_runs(self.get_stream_chain(x))) for x in (self.root, *self.walk())]
+
+    def write_index(self, index_path: Union[str, os.PathLike]):
+        # Writes a sidecar that lets later readers skip parsing this file
+        if self.path is None:
+            raise ValueError('An index sidecar can only be written for a file path')
+        write_index(index_path, self.path, self.get_index_records())
+
+def expand_runs(runs: list[Run]) -> list[int]:
+    return [x for start, count in runs for x in range(start, start + count)]
@@ -0,0 +1,101 @@
+import ctypes
+import math
+from typing import Optional, Union
+import uuid
+
+from pycfb.cfbutility import CFBWriter
+from pycfb.constants import SHIFT_MINISECTOR_BITS, SHIFT_SECTOR_BITS_V3, SIZE_MINISTREAM_CUTOFF_BYTES
+from pycfb.types import DirEntry
+from pycfb.util import StreamSource, copy_stream
+
+class CFBTemplate:
+    """
+    Precomputed layout for many CFB files with the same stream_paths. The header,
+    FAT, MiniFAT, DIFAT and directory sectors are serialized once, and fill() only
+    copies stream data into fixed offsets.
+
+    A stream may change size without a new layout as long as it stays on the same
+    side of the ministream cutoff and needs the same number of sectors; only its
+    directory size field is patched. Otherwise the layout is rebuilt for the new
+    sizes, and later fills reuse it.
+    """
+    def __init__(
+        self,
+        stream_paths: list[str],
+        root_clsid: uuid.UUID,
+        stream_sizes: Optional[list[Optional[int]]] = None
+    ):
+        self.stream_paths = stream_paths
+        self.root_clsid = root_clsid
+
+        self.stream_sizes: list[Optional[int]] = []
+        self.stream_offsets: list[Optional[int]] = []
+        self.size_offsets: list[Optional[int]] = []
+        self.total_size_bytes = 0
+        self.prefix = b''
+        self.suffix = b''
+        self.suffix_offset = 0
+
+        if stream_sizes is not None:
+            self.build(stream_sizes)
+
+    def build(self, stream_sizes: list[Optional[int]]):
+        # Lay out zero-filled placeholders, then keep only the metadata
+        placeholders = [None if x is None else StreamSource(x, None) for x in stream_sizes]
+        ctx = CFBWriter(self.stream_paths, placeholders, self.root_clsid).ctx
+
+        self.stream_sizes = list(stream_sizes)
+        self.stream_offsets = [
+            None if x is None else ctx.get_stream_offset(idx)
+            for idx, x in enumerate(stream_sizes)
+        ]
+        self.size_offsets = [None] * len(stream_sizes)
+        for i, x in enumerate(ctx.file_tree):
+            if x.original_index is not None and stream_sizes[x.original_index] is not None:
+                entry_offset = ctx.get_sector_offset(ctx.directory[i + 1])
+                self.size_offsets[x.original_index] = entry_offset + DirEntry.size_bytes.offset
+
+        # Header, FAT, MiniFAT and DIFAT come first, the directory comes last
+        prefix_size_sectors = 1 + len(ctx.fat) + len(ctx.minifat) + len(ctx.difat)
+        self.prefix = bytes(ctx.data[:prefix_size_sectors * ctx.sector_size_bytes])
+        self.suffix_offset = ctx.get_sector_offset(ctx.directory[0])
+        self.suffix = bytes(ctx.data[self.suffix_offset:])
+        self.total_size_bytes = len(ctx.data)
+
+    def is_compatible(self, stream_sizes: list[Optional[int]]) -> bool:
+        if len(stream_sizes) != len(self.stream_sizes):
+            return False
+        for new, old in zip(stream_sizes, self.stream_sizes):
+            if (new is None) != (old is None):
+                return False
+            if new is not None and get_size_units(new) != get_size_units(old):
+                return False
+        return True
+
+    def fill(self, stream_data: list[Union[bytes, StreamSource, None]]) -> bytearray:
+        stream_sizes = [None if x is None else len(x) for x in stream_data]
+        if not self.is_compatible(stream_sizes):
+            self.build(stream_sizes)
+
+        data = bytearray(self.total_size_bytes)
+        data[:len(self.prefix)] = self.prefix
+        data[self.suffix_offset:] = self.suffix
+
+        view = memoryview(data)
+        for idx, stream in enumerate(stream_data):
+            if stream is None:
+                continue
+            if len(stream) != self.stream_sizes[idx]:
+                ctypes.c_uint64.from_buffer(data, self.size_offsets[idx]).value = len(stream)
+
+            offset = self.stream_offsets[idx]
+            copy_stream(view[offset : offset + len(stream)], stream)
+
+        view.release()
+        return data
+
+def get_size_units(size: int) -> tuple[bool, int]:
+    # Whether a stream is in the ministream, and how many sectors it needs there
+    if size < SIZE_MINISTREAM_CUTOFF_BYTES:
+        return (True, math.ceil(size / 2**SHIFT_MINISECTOR_BITS))
+    return (False, math.ceil(size / 2**SHIFT_SECTOR_BITS_V3))
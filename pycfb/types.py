@@ -95,3 +95,55 @@ class DirEntry(ctypes.Structure):
     time_modified: int
     sector_start: int
     size_bytes: int
+
+class IndexHeader(ctypes.Structure):
+    _pack_ = 1
+    _fields_ = [
+        ("signature", ctypes.c_uint64),
+        ("version", ctypes.c_uint32),
+        ("entry_count", ctypes.c_uint32),
+        ("file_size", ctypes.c_uint64),
+        ("file_mtime_ns", ctypes.c_uint64),
+        ("header_hash", ctypes.c_ubyte * 32),
+    ]
+
+    # VSCode type hints
+    signature: int
+    version: int
+    entry_count: int
+    file_size: int
+    file_mtime_ns: int
+    header_hash: ctypes.Array[ctypes.c_ubyte]
+
+class IndexRecord(ctypes.Structure):
+    # Followed by the UTF-8 path, run_count (start, count) pairs and the record
+    # numbers of child_count children in CFB name order
+    _pack_ = 1
+    _fields_ = [
+        ("id", ctypes.c_uint32),
+        ("child_id", ctypes.c_uint32),
+        ("object_type", ctypes.c_uint8),
+        ("reserved", ctypes.c_uint8),
+        ("path_len_bytes", ctypes.c_uint16),
+        ("sector_start", ctypes.c_uint32),
+        ("size_bytes", ctypes.c_uint64),
+        ("clsid", ctypes.c_byte * 16),
+        ("time_created", ctypes.c_uint64),
+        ("time_modified", ctypes.c_uint64),
+        ("run_count", ctypes.c_uint32),
+        ("child_count", ctypes.c_uint32),
+    ]
+
+    # VSCode type hints
+    id: int
+    child_id: int
+    object_type: int
+    reserved: int
+    path_len_bytes: int
+    sector_start: int
+    size_bytes: int
+    clsid: ctypes.Array[ctypes.c_byte]
+    time_created: int
+    time_modified: int
+    run_count: int
+    child_count: int
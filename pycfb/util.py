@@ -1,8 +1,32 @@
 from collections import defaultdict
 from dataclasses import dataclass
 import os
-from pathlib import Path
-from typing import Optional
+from typing import BinaryIO, Callable, Optional, Union
+import uuid
+
+from pycfb.constants import SIZE_COPY_CHUNK_BYTES, SIZE_SPARSE_BLOCK_BYTES
+from pycfb.digest import Digest
+from pycfb.enums import DirType
+from pycfb.types import DirEntry
+
+@dataclass(frozen=True)
+class CFBEntry:
+    id: int
+    path: str
+    name: str
+    type: DirType
+    size: int
+    start_sector: int
+    clsid: uuid.UUID
+    time_created: int
+    time_modified: int
+    child_id: int
+
+    def is_storage(self) -> bool:
+        return self.type in (DirType.STORAGE, DirType.ROOTSTORAGE)
+
+    def is_stream(self) -> bool:
+        return self.type == DirType.STREAM
 
 @dataclass
 class FileTreeItem:
@@ -12,15 +36,118 @@ class FileTreeItem:
     original_index: Optional[int] = None
     parent_index: Optional[int] = None
 
-def get_unique_subdirs(paths: list[str]) -> list[str]:
-    all_levels = set()
-    for p in paths:
-        for ancestor in Path(p).parents:
-            ancestor_str = str(ancestor)
-            # Filter out both the root and the current directory indicator
-            if ancestor_str not in ('.', '/'):
-                all_levels.add(ancestor_str)
-    return sorted(list(all_levels))
+@dataclass
+class StreamSource:
+    # Stream content that is read on demand instead of held in memory.
+    # The size must be known up front so that the layout can be planned.
+    # Without an opener, the space is reserved and left zero-filled.
+    size: int
+    open: Optional[Callable[[], BinaryIO]]
+
+    def __len__(self) -> int:
+        return self.size
+
+def copy_stream(
+    view: memoryview,
+    stream: Union[bytes, StreamSource],
+    digest: Optional[Digest] = None
+):
+    # Copies stream content into a pre-sized region of the output buffer,
+    # hashing each chunk as it lands so the input is only read once
+    if not isinstance(stream, StreamSource):
+        if digest is None:
+            view[:] = stream
+            return
+
+        source = memoryview(stream)
+        for start in range(0, len(view), SIZE_COPY_CHUNK_BYTES):
+            chunk = view[start : start + SIZE_COPY_CHUNK_BYTES]
+            chunk[:] = source[start : start + SIZE_COPY_CHUNK_BYTES]
+            digest.update(chunk)
+        return
+
+    if stream.open is None:
+        return
+
+    filled = 0
+    with stream.open() as f:
+        while filled < len(view):
+            n = f.readinto(view[filled:])
+            if not n:
+                raise ValueError(f'Stream ended after {filled} of {len(view)} bytes')
+            if digest is not None:
+                digest.update(view[filled : filled + n])
+            filled += n
+
+def write_sparse(f: BinaryIO, data: Union[bytes, bytearray]):
+    # Writes data but seeks over all-zero blocks, which become holes on
+    # filesystems that support sparse files. Skipped blocks keep whatever f held
+    # before, so f must be a newly created file.
+    view = memoryview(data)
+    zero_block = memoryview(bytes(SIZE_SPARSE_BLOCK_BYTES))
+    start = f.tell()
+    run_start = None
+
+    for offset in range(0, len(view), SIZE_SPARSE_BLOCK_BYTES):
+        block = view[offset : offset + SIZE_SPARSE_BLOCK_BYTES]
+        if block == zero_block[:len(block)]:
+            if run_start is not None:
+                f.write(view[run_start:offset])
+                run_start = None
+        elif run_start is None:
+            f.seek(start + offset)
+            run_start = offset
+
+    if run_start is not None:
+        f.write(view[run_start:])
+    elif len(view) > 0:
+        # Writing the last byte extends the file over a trailing hole, which
+        # truncate() does not do for every file object
+        f.seek(start + len(view) - 1)
+        f.write(view[-1:])
+
+def get_dir_name_key(name: str) -> tuple[int, str]:
+    # Directory entries are ordered by UTF-16 name length, then by uppercase name
+    return (len(name.encode('utf-16-le')), name.upper())
+
+def get_runs(values: list[int], step: int = 1) -> list[tuple[int, int]]:
+    # Groups consecutive values into (start, count) runs
+    runs = []
+    for x in values:
+        if runs and x == runs[-1][0] + runs[-1][1] * step:
+            runs[-1] = (runs[-1][0], runs[-1][1] + 1)
+        else:
+            runs.append((x, 1))
+    return runs
+
+def make_entry(sid: int, direntry: DirEntry, parent_path: str) -> CFBEntry:
+    name = get_direntry_name(direntry)
+    if direntry.object_type == DirType.ROOTSTORAGE:
+        path = ''
+    elif parent_path:
+        path = f'{parent_path}/{name}'
+    else:
+        path = name
+
+    return CFBEntry(
+        id=sid,
+        path=path,
+        name=name,
+        type=DirType(direntry.object_type),
+        size=direntry.size_bytes,
+        start_sector=direntry.sector_start,
+        clsid=uuid.UUID(bytes=bytes(direntry.clsid)),
+        time_created=direntry.time_created,
+        time_modified=direntry.time_modified,
+        child_id=direntry.child_id
+    )
+
+def get_direntry_name(direntry: DirEntry) -> str:
+    # Name length includes the terminating null character
+    return bytes(direntry.name[:max(direntry.name_len_bytes - 2, 0)]).decode('utf-16-le')
+
+def split_path(path: str) -> list[str]:
+    return [x for x in path.replace(os.sep, '/').split('/') if x not in ('', '.')]
 
 def get_file_tree(paths: list[str]) -> list[FileTreeItem]:
     visited = {}
@@ -49,6 +176,9 @@ def get_file_tree(paths: list[str]) -> list[FileTreeItem]:
                     is_file=is_file,
                     original_index=idx if is_input_leaf else None
                 )
+            elif is_input_leaf:
+                # Folder was first seen as the parent of an earlier path
+                visited[segment].original_index = idx
 
     # Map children
     children_map = defaultdict(list)
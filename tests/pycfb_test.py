@@ -1,9 +1,24 @@
+import contextlib
+import ctypes
 import glob
+import hashlib
+import io
+import math
 import os
+import random
+import tarfile
+import tempfile
+import threading
 import unittest
 import uuid
+import zipfile
+import zlib
 
-from pycfb import CFBWriter
+from pycfb import CFBReader, CFBTemplate, CFBWriter, analyze, from_archive
+from pycfb.analysis import main as analysis_main
+from pycfb.enums import Sector
+from pycfb.types import IndexHeader
+from pycfb.util import write_sparse
 
 # Shared paths
 LOCAL_BASE_PATH = os.path.abspath(os.path.dirname(__file__))
@@ -47,5 +62,384 @@ class CFBTests(unittest.TestCase):
             with open(os.path.join(LOCAL_OUTPUT_PATH, f'test{i}.ole'), 'wb') as f:
                 f.write(x.data)
 
+    def test_from_archive(self):
+        root_clsid = uuid.UUID('BE87C5E3-E3CB-4BAB-8427-578ECCE263F7')
+        paths = ['folder', 'folder/large.bin', 'folder/small.txt', 'top.txt']
+        data = [None, bytes(range(256)) * 40, b'hello', b'world' * 1000]
+        expected = CFBWriter(paths, data, root_clsid).data
+
+        zip_buffer = io.BytesIO()
+        with zipfile.ZipFile(zip_buffer, 'w') as archive:
+            for path, stream in zip(paths, data):
+                if stream is None:
+                    archive.writestr(f'{path}/', b'')
+                else:
+                    archive.writestr(path, stream)
+
+        tar_buffer = io.BytesIO()
+        with tarfile.open(fileobj=tar_buffer, mode='w:gz') as archive:
+            for path, stream in zip(paths, data):
+                member = tarfile.TarInfo(path)
+                if stream is None:
+                    member.type = tarfile.DIRTYPE
+                    archive.addfile(member)
+                else:
+                    member.size = len(stream)
+                    archive.addfile(member, io.BytesIO(stream))
+
+        for src in (zip_buffer, tar_buffer):
+            out = io.BytesIO()
+            from_archive(src, out, root_clsid)
+            self.assertEqual(out.getvalue(), expected)
+
+        # Repeated member names keep only the last copy
+        tar_buffer = io.BytesIO()
+        with tarfile.open(fileobj=tar_buffer, mode='w') as archive:
+            for stream in (b'a' * 100000, b'b' * 100000):
+                member = tarfile.TarInfo('dup.bin')
+                member.size = len(stream)
+                archive.addfile(member, io.BytesIO(stream))
+
+        zip_buffer = io.BytesIO()
+        with zipfile.ZipFile(zip_buffer, 'w') as archive:
+            archive.writestr('dup.bin', b'a' * 100000)
+            with self.assertWarns(UserWarning):
+                archive.writestr('dup.bin', b'b' * 100000)
+
+        expected = CFBWriter(['dup.bin'], [b'b' * 100000], root_clsid).data
+        for src in (zip_buffer, tar_buffer):
+            out = io.BytesIO()
+            from_archive(src, out, root_clsid)
+            self.assertEqual(out.getvalue(), expected)
+
+        def make_tar(members):
+            buffer = io.BytesIO()
+            with tarfile.open(fileobj=buffer, mode='w') as archive:
+                for member, stream in members:
+                    archive.addfile(member, None if stream is None else io.BytesIO(stream))
+            return buffer
+
+        def make_file(name, stream):
+            member = tarfile.TarInfo(name)
+            member.size = len(stream)
+            return member, stream
+
+        def make_link(name, target, link_type):
+            member = tarfile.TarInfo(name)
+            member.type = link_type
+            member.linkname = target
+            return member, None
+
+        # An uncompressed tar that ends in a zip member is still read as a tar
+        xlsx = io.BytesIO()
+        with zipfile.ZipFile(xlsx, 'w') as archive:
+            archive.writestr('[Content_Types].xml', b'<Types/>')
+        src = make_tar([make_file('readme.txt', b'hello'), make_file('report.xlsx', xlsx.getvalue())])
+        with CFBReader(from_archive(src, io.BytesIO(), root_clsid).data) as reader:
+            self.assertEqual(sorted(e.path for e in reader.walk()), ['readme.txt', 'report.xlsx'])
+            self.assertEqual(reader.read('report.xlsx'), xlsx.getvalue())
+
+        # Absolute names are relative to the root, and hard links share their target's content
+        src = make_tar([
+            make_file('/abs/x.txt', b'hello'),
+            make_link('abs/y.txt', '/abs/x.txt', tarfile.LNKTYPE),
+            make_link('abs/z.txt', 'x.txt', tarfile.SYMTYPE)
+        ])
+        with self.assertWarns(UserWarning):
+            writer = from_archive(src, io.BytesIO(), root_clsid)
+        with CFBReader(writer.data) as reader:
+            self.assertEqual(sorted(e.path for e in reader.walk()), ['abs', 'abs/x.txt', 'abs/y.txt'])
+            self.assertEqual(reader.read('abs/y.txt'), b'hello')
+
+        # Names that leave the root or collide once truncated are rejected
+        for members in (
+            [make_file('../y.txt', b'hello')],
+            [make_file('a' * 31 + 'x.txt', b'1'), make_file('a' * 31 + 'y.txt', b'2')],
+            [make_file('Data.txt', b'1'), make_file('DATA.txt', b'2')]
+        ):
+            self.assertRaises(ValueError, from_archive, make_tar(members), io.BytesIO(), root_clsid)
+
+    def test_read_cfb(self):
+        paths = ['folder', 'folder/large.bin', 'folder/small.txt', 'folder/sub', 'top.txt']
+        data = [None, bytes(range(256)) * 40, b'hello', None, b'world' * 1000]
+        paths += [f'folder/sub/item{x}' for x in range(100)]
+        data += [str(x).encode() for x in range(100)]
+        x = CFBWriter(paths, data, uuid.UUID('BE87C5E3-E3CB-4BAB-8427-578ECCE263F7'))
+
+        with CFBReader(x.data) as reader:
+            self.assertEqual(reader.root.clsid, uuid.UUID('BE87C5E3-E3CB-4BAB-8427-578ECCE263F7'))
+            self.assertEqual(sorted(e.path for e in reader.walk()), sorted(paths))
+            self.assertEqual(
+                [e.name for e in reader.scandir('folder')],
+                ['sub', 'large.bin', 'small.txt']
+            )
+            self.assertEqual(reader.stat('folder/sub/item42').size, 2)
+            self.assertTrue(reader.stat('folder/sub').is_storage())
+            self.assertRaises(FileNotFoundError, reader.stat, 'folder/missing')
+            for path, stream in zip(paths, data):
+                if stream is not None:
+                    self.assertEqual(reader.read(path), stream)
+
+        # Sibling cycles and out of range ids are reported rather than followed
+        for data2 in self.make_corrupt_trees(paths, data):
+            with CFBReader(data2) as reader:
+                self.assertRaises(ValueError, list, reader.walk())
+                self.assertRaises(ValueError, reader.stat, 'folder/small.txt')
+            self.assertRaises(ValueError, CFBReader, data2, threadsafe=True)
+
+    def make_corrupt_trees(self, paths, data):
+        # The root's child points at itself, then past the end of the directory
+        cycle = CFBWriter(paths, data, uuid.UUID('BE87C5E3-E3CB-4BAB-8427-578ECCE263F7'))
+        child_id = cycle.ctx.directory[0].child_id
+        cycle.ctx.directory[child_id].left_sibling_id = child_id
+        cycle.ctx.directory[child_id].right_sibling_id = child_id
+        out_of_range = CFBWriter(paths, data, uuid.UUID('BE87C5E3-E3CB-4BAB-8427-578ECCE263F7'))
+        out_of_range.ctx.directory[0].child_id = 100000
+        return [cycle.data, out_of_range.data]
+
+    def test_fat_size_exact(self):
+        # Small streams, directory sectors filled exactly, and enough sectors
+        # to need a DIFAT sector
+        cases = [
+            ([f'item{x}' for x in range(2000)], [b'x' * (x % 100) for x in range(2000)]),
+            ([f'item{x}' for x in range(7)], [b''] * 7),
+            (['large.bin'], [b'x' * 14000 * 512])
+        ]
+        for paths, data in cases:
+            x = CFBWriter(paths, data, uuid.UUID('BE87C5E3-E3CB-4BAB-8427-578ECCE263F7'))
+            used_sectors = len(x.data) // x.ctx.sector_size_bytes - 1
+            self.assertEqual(x.ctx.next_freesect_offset, len(x.data))
+            self.assertEqual(x.ctx.calc_fat_size_entries(), used_sectors)
+            self.assertEqual(len(x.ctx.fat), math.ceil(used_sectors / x.ctx.fat_entries_per_sector))
+
+            fat = CFBReader(x.data).fat
+            self.assertNotIn(Sector.FREESECT, fat[:used_sectors])
+            self.assertTrue(all(e == Sector.FREESECT for e in fat[used_sectors:]))
+
+    def test_read_cfb_threadsafe(self):
+        paths = [f'folder{x % 4}/item{x}' for x in range(200)]
+        data = [bytes([x]) * (x * 97) for x in range(200)]
+        x = CFBWriter(paths, data, uuid.UUID('BE87C5E3-E3CB-4BAB-8427-578ECCE263F7'))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'test.ole')
+            with open(path, 'wb') as f:
+                f.write(x.data)
+
+            errors = []
+            with CFBReader(path, threadsafe=True) as reader:
+                # Directory listings come from the structures built on open
+                with CFBReader(x.data) as expected:
+                    self.assertEqual(list(reader.walk()), list(expected.walk()))
+                    self.assertEqual(list(reader.scandir('folder1')), list(expected.scandir('folder1')))
+                reader.read_direntry = None
+                self.assertEqual(len(list(reader.walk())), 204)
+                self.assertRaises(NotADirectoryError, reader.stat, 'folder0/item0/x')
+                self.assertRaises(FileNotFoundError, reader.stat, 'folder0/missing')
+
+                barrier = threading.Barrier(8)
+                def worker(seed):
+                    rng = random.Random(seed)
+                    barrier.wait()
+                    for _ in range(300):
+                        idx = rng.randrange(len(paths))
+                        if reader.read(paths[idx]) != data[idx]:
+                            errors.append(paths[idx])
+
+                threads = [threading.Thread(target=worker, args=(y,)) for y in range(8)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+
+            self.assertEqual(errors, [])
+
+    def test_index_sidecar(self):
+        paths = ['folder', 'folder/large.bin', 'folder/small.txt', 'folder/sub', 'top.txt']
+        data = [None, bytes(range(256)) * 40, b'hello', None, b'world' * 1000]
+        paths += [f'folder/sub/item{x}' for x in range(100)]
+        data += [str(x).encode() for x in range(100)]
+        x = CFBWriter(paths, data, uuid.UUID('BE87C5E3-E3CB-4BAB-8427-578ECCE263F7'))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'test.ole')
+            index_path = os.path.join(tmp, 'test.idx')
+            reader_index_path = os.path.join(tmp, 'reader.idx')
+            x.save(path, index_path)
+
+            # The writer's sidecar matches one built by walking the file
+            with CFBReader(path) as reader:
+                reader.write_index(reader_index_path)
+                expected = list(reader.walk())
+            with open(index_path, 'rb') as f1, open(reader_index_path, 'rb') as f2:
+                self.assertEqual(f1.read(), f2.read())
+
+            with CFBReader(path, index_path=index_path) as reader:
+                self.assertIsNotNone(reader.index)
+                self.assertIsNone(reader.fat)
+                self.assertEqual(list(reader.walk()), expected)
+                self.assertEqual([e.name for e in reader.scandir('folder')], ['sub', 'large.bin', 'small.txt'])
+                self.assertRaises(FileNotFoundError, reader.stat, 'folder/missing')
+                self.assertRaises(NotADirectoryError, reader.stat, 'folder/small.txt/x')
+                for path2, stream in zip(paths, data):
+                    if stream is not None:
+                        self.assertEqual(reader.read(path2), stream)
+
+            # A rewritten file no longer matches its sidecar
+            os.utime(path, ns=(0, 0))
+            with CFBReader(path, index_path=index_path) as reader:
+                self.assertIsNone(reader.index)
+                self.assertEqual(reader.read('folder/small.txt'), b'hello')
+
+            # Missing, empty and truncated sidecars are ignored the same way
+            x.save(path, index_path)
+            self.assertEqual(glob.glob(os.path.join(tmp, '*.tmp')), [])
+            with open(index_path, 'rb') as f:
+                index_data = f.read()
+            broken_path = os.path.join(tmp, 'broken.idx')
+            for broken in (b'', index_data[:ctypes.sizeof(IndexHeader)], index_data[:len(index_data) // 2]):
+                with open(broken_path, 'wb') as f:
+                    f.write(broken)
+                with CFBReader(path, index_path=broken_path) as reader:
+                    self.assertIsNone(reader.index)
+                    self.assertEqual(reader.read('folder/small.txt'), b'hello')
+            with CFBReader(path, index_path=os.path.join(tmp, 'missing.idx')) as reader:
+                self.assertIsNone(reader.index)
+
+    def test_digests(self):
+        paths = ['folder', 'folder/large.bin', 'folder/small.txt', 'empty.txt']
+        data = [None, bytes(range(256)) * 40, b'hello', b'']
+        x = CFBWriter(paths, data, uuid.UUID('BE87C5E3-E3CB-4BAB-8427-578ECCE263F7'), digest='sha256')
+        self.assertEqual(x.digests, {
+            path: hashlib.sha256(stream).hexdigest()
+            for path, stream in zip(paths, data) if stream is not None
+        })
+
+        x = CFBWriter(paths, data, uuid.UUID('BE87C5E3-E3CB-4BAB-8427-578ECCE263F7'), digest='crc32')
+        self.assertEqual(x.digests['folder/large.bin'], f'{zlib.crc32(data[1]):08x}')
+
+        # Manifests small enough for the ministream and large enough for regular sectors
+        for count in (1, 100):
+            paths2 = paths + [f'folder/item{y}' for y in range(count)]
+            data2 = data + [str(y).encode() for y in range(count)]
+            x = CFBWriter(
+                paths2,
+                data2,
+                uuid.UUID('BE87C5E3-E3CB-4BAB-8427-578ECCE263F7'),
+                digest='sha256',
+                manifest_path='manifest.sha256'
+            )
+            self.assertNotIn('manifest.sha256', x.digests)
+
+            expected = ''.join(f'{x.digests[path]}  {path}\n' for path in paths2 if path != 'folder')
+            with CFBReader(x.data) as reader:
+                self.assertEqual(reader.read('manifest.sha256').decode('utf-8'), expected)
+                self.assertEqual(reader.read('folder/small.txt'), b'hello')
+
+        root_clsid = uuid.UUID('BE87C5E3-E3CB-4BAB-8427-578ECCE263F7')
+        self.assertRaises(ValueError, CFBWriter, paths, data, root_clsid, 'sha256', 'folder/small.txt')
+        self.assertRaises(ValueError, CFBWriter, paths, data, root_clsid, 'sha256', './folder')
+        self.assertRaises(ValueError, CFBWriter, ['folder/x.txt', 'x.txt'], [b'1', b'2'], root_clsid, 'sha256', 'folder')
+        self.assertRaises(ValueError, CFBWriter, ['folder/x.txt', 'x.txt'], [b'1', b'2'], root_clsid, 'sha256', 'x.txt/m')
+        CFBWriter(paths, data, root_clsid, 'sha256', 'folder/manifest')
+        self.assertRaises(ValueError, CFBWriter, paths, data, root_clsid, 'shake_128', 'manifest')
+
+    def test_template(self):
+        root_clsid = uuid.UUID('BE87C5E3-E3CB-4BAB-8427-578ECCE263F7')
+        paths = ['folder', 'folder/large.bin', 'folder/small.txt', 'top.txt']
+        template = CFBTemplate(paths, root_clsid, [None, 10240, 5, 5000])
+
+        cases = [
+            [None, b'a' * 10240, b'hello', b'b' * 5000],  # Same sizes
+            [None, b'c' * 10000, b'hi', b'd' * 4900],     # Same sector counts
+            [None, b'e' * 20000, b'f' * 200, b'g' * 10],  # New layout
+            [None, b'h' * 19999, b'i' * 199, b'j' * 11],  # Reuses the new layout
+        ]
+        for data in cases:
+            self.assertEqual(template.fill(data), CFBWriter(paths, data, root_clsid).data)
+
+        # Sizes can also come from the first fill
+        template = CFBTemplate(paths, root_clsid)
+        self.assertEqual(template.fill(cases[0]), CFBWriter(paths, cases[0], root_clsid).data)
+
+    def test_save_sparse(self):
+        paths = ['zeros.bin', 'small.txt', 'mixed.bin', 'tail.bin']
+        data = [bytes(1000000), b'hello', (b'x' * 5000 + bytes(50000)) * 3, bytes(9000)]
+        x = CFBWriter(paths, data, uuid.UUID('BE87C5E3-E3CB-4BAB-8427-578ECCE263F7'))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'test.ole')
+            x.save(path, sparse=True)
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), x.data)
+
+            with CFBReader(path) as reader:
+                for path2, stream in zip(paths, data):
+                    self.assertEqual(reader.read(path2), stream)
+
+            # Output ending in an all-zero block still has its full size
+            x = CFBWriter(['small.txt'], [b'hello'], uuid.UUID('BE87C5E3-E3CB-4BAB-8427-578ECCE263F7'))
+            data2 = bytes(x.data) + bytes(8192)
+            with open(path, 'wb') as f:
+                write_sparse(f, data2)
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), data2)
+
+        # File objects may already hold data, so only paths can be sparse
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as z:
+            z.writestr('zeros.bin', bytes(10000))
+        self.assertRaises(ValueError, from_archive, archive, io.BytesIO(b'x' * 20000), sparse=True)
+
+    def test_analyze(self):
+        paths = ['folder', 'folder/large.bin', 'folder/small.txt', 'top.txt']
+        data = [None, b'a' * 10000, b'hello', b'b' * 100]
+        x = CFBWriter(paths, data, uuid.UUID('BE87C5E3-E3CB-4BAB-8427-578ECCE263F7'))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'test.ole')
+            x.save(path)
+            result = analyze(path)
+
+        self.assertEqual(result.total_sectors, len(x.data) // 512)
+        self.assertEqual(result.fat_sectors, 1)
+        self.assertEqual(result.difat_sectors, 0)
+        self.assertEqual(result.minifat_sectors, 1)
+        self.assertEqual(result.directory_sectors, 2)
+        self.assertEqual(result.ministream_sectors, 1)
+        self.assertEqual(result.stream_sectors, 20)
+        self.assertEqual(result.free_sectors, 0)
+        self.assertEqual(result.unaccounted_sectors, 0)
+        self.assertEqual(result.free_minisectors, 0)
+        self.assertEqual((result.ministream_stream_count, result.ministream_stream_bytes), (2, 105))
+        self.assertEqual((result.regular_stream_count, result.regular_stream_bytes), (1, 10000))
+        self.assertEqual(result.fragmented_stream_count, 0)
+
+        streams = {s.path: s for s in result.streams}
+        self.assertEqual(streams['folder/large.bin'].padding_bytes, 20 * 512 - 10000)
+        self.assertEqual(streams['top.txt'].padding_bytes, 2 * 64 - 100)
+        self.assertEqual(result.ministream_padding_bytes, 512 - 3 * 64)
+
+        # The command line reports bad files and carries on with the rest
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'test.ole')
+            bad_path = os.path.join(tmp, 'bad.ole')
+            x.save(path)
+            with open(bad_path, 'wb') as f:
+                f.write(bytes(512))
+            corrupt_paths = []
+            for i, data2 in enumerate(self.make_corrupt_trees(paths, data)):
+                corrupt_paths.append(os.path.join(tmp, f'corrupt{i}.ole'))
+                with open(corrupt_paths[-1], 'wb') as f:
+                    f.write(data2)
+
+            stdout, stderr = io.StringIO(), io.StringIO()
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                with self.assertRaises(SystemExit) as cm:
+                    analysis_main([bad_path, *corrupt_paths, os.path.join(tmp, 'missing.ole'), path])
+            self.assertEqual(cm.exception.code, 1)
+            self.assertTrue(stdout.getvalue().startswith(f'{path}: '))
+            self.assertEqual(len(stderr.getvalue().splitlines()), 4)
+
     def tearDown(self):
         pass